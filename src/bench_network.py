@@ -0,0 +1,73 @@
+from transaction_manager import TransactionManager, NUM_VARS
+from network_model import NetworkModel
+import argparse
+import contextlib
+import logging
+import os
+import random
+
+
+def generate_ops(num_transactions, ops_per_transaction, write_fraction, seed):
+    """ transactions run one after the other, each op writes with probability write_fraction """
+    rng = random.Random(seed)
+    ops = []
+    for transaction_index in range(1, num_transactions + 1):
+        ops.append("begin(T%s)" % transaction_index)
+        for i in range(ops_per_transaction):
+            var_index = rng.randint(1, NUM_VARS)
+            if rng.random() < write_fraction:
+                ops.append("W(T%s, x%s, %s)" % (transaction_index, var_index, rng.randint(0, 1000)))
+            else:
+                ops.append("R(T%s, x%s)" % (transaction_index, var_index))
+        ops.append("end(T%s)" % transaction_index)
+    return ops
+
+
+def run(ops, network):
+    """ run the workload with the network model attached """
+    tm = TransactionManager(echo=False, network=network)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for op in ops:
+            tm.execute(op)
+        while tm.execute(None):
+            pass
+    return network
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="simulated messages and commit latency per transaction under different networks")
+    parser.add_argument("--transactions", type=int, default=1000)
+    parser.add_argument("--ops", type=int, default=6, help="ops per transaction")
+    parser.add_argument("--latency", type=float, default=1.0, help="one way latency in ms")
+    parser.add_argument("--slow-latency", type=float, default=20.0, help="one way latency in ms of the slow site")
+    parser.add_argument("--jitter", type=float, default=0.5, help="jitter in ms")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    networks = [
+        ("uniform", {}),
+        ("jitter", {"jitter": args.jitter}),
+        ("slow site 10", {"site_latency": {10: args.slow_latency}}),
+    ]
+    for write_fraction in (0.1, 0.5, 0.9):
+        ops = generate_ops(args.transactions, args.ops, write_fraction, args.seed)
+        print("writes %d%%" % (write_fraction * 100))
+        for name, options in networks:
+            network = run(ops, NetworkModel(latency=args.latency, seed=args.seed, **options))
+            transactions = network.order
+            commit_latencies = network.commit_latencies()
+            total_time = sum(network.network_time.values())
+            probe_time = network.call_round_time.get('try_write_lock', 0.0)
+            print("  %-14s messages/T %6.1f  network/T %7.3f ms  commit p50 %7.3f ms  p99 %7.3f ms  lock probe rounds %4.1f%% of network time" % (
+                name,
+                sum(network.messages.values()) / len(transactions),
+                total_time / len(transactions),
+                percentile(commit_latencies, 0.5),
+                percentile(commit_latencies, 0.99),
+                100 * probe_time / total_time))
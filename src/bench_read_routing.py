@@ -0,0 +1,64 @@
+from transaction_manager import TransactionManager, NUM_VARS
+from profiler import Profiler
+import argparse
+import contextlib
+import logging
+import os
+import random
+import time
+
+
+def generate_ops(num_transactions, reads_per_transaction, concurrency, seed):
+    """ read-heavy workload on replicated variables, concurrency transactions open at a time """
+    rng = random.Random(seed)
+    even_vars = list(range(2, NUM_VARS+1, 2))
+    ops = []
+    for batch_start in range(1, num_transactions + 1, concurrency):
+        batch = range(batch_start, min(batch_start + concurrency, num_transactions + 1))
+        for transaction_index in batch:
+            ops.append("begin(T%s)" % transaction_index)
+        for i in range(reads_per_transaction):
+            for transaction_index in batch:
+                ops.append("R(T%s, x%s)" % (transaction_index, rng.choice(even_vars)))
+        for transaction_index in batch:
+            ops.append("end(T%s)" % transaction_index)
+    return ops
+
+
+def run(ops, read_policy):
+    """ run the workload, return per-site lock grants, peak occupancy and read time """
+    profiler = Profiler()
+    tm = TransactionManager(read_policy=read_policy)
+    for site in tm.sites:
+        profiler.instrument(site.DM, ('read',), "site%s." % site.index)
+    peak_occupancy = [0] * len(tm.sites)
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for op in ops:
+            tm.execute(op)
+            for i, site in enumerate(tm.sites):
+                peak_occupancy[i] = max(peak_occupancy[i], site.DM.get_lock_occupancy())
+        while tm.execute(None):
+            pass
+    elapsed = time.perf_counter() - start
+    grants = [site.DM.lock_grants for site in tm.sites]
+    read_time = [profiler.total_time.get("site%s.read" % site.index, 0.0) for site in tm.sites]
+    return grants, peak_occupancy, read_time, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="spread of lock load across sites for each read routing policy")
+    parser.add_argument("--transactions", type=int, default=2000)
+    parser.add_argument("--reads", type=int, default=5, help="reads per transaction")
+    parser.add_argument("--concurrency", type=int, default=20, help="transactions open at a time")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    ops = generate_ops(args.transactions, args.reads, args.concurrency, args.seed)
+    for read_policy in TransactionManager.ReadPolicy:
+        grants, peak_occupancy, read_time, elapsed = run(ops, read_policy)
+        print("%s (%.3f s)" % (read_policy.name, elapsed))
+        print("  lock grants per site:    %s" % " ".join("%6d" % g for g in grants))
+        print("  peak locked vars:        %s" % " ".join("%6d" % o for o in peak_occupancy))
+        print("  read time per site (ms): %s" % " ".join("%6.1f" % (t * 1000) for t in read_time))
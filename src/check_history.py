@@ -0,0 +1,18 @@
+from history import HistoryRecorder, HistoryChecker
+import argparse
+import sys
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="python3 check_history.py <historyfile>")
+    parser.add_argument("historyfile")
+    args = parser.parse_args()
+
+    checker = HistoryChecker(HistoryRecorder.load(args.historyfile))
+    violations = checker.check()
+    if len(violations) == 0:
+        print("History is serializable (%s committed transactions, %s records)." % (len(checker.transaction_at), checker.num_ops))
+        sys.exit(0)
+    for violation in violations:
+        print(violation)
+    sys.exit(1)
@@ -0,0 +1,81 @@
+import os
+import logging
+from array import array
+from bisect import bisect_right
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+INT64_MIN = -2**63
+INT64_MAX = 2**63 - 1
+
+
+class CommittedState(object):
+    """ columnar committed values of one site: latest value per variable plus a commit log """
+
+    def __init__(self, num_vars):
+        self.num_vars = num_vars
+        # index = var index, allocated on first use
+        self.latest_values = None
+        # commit log in commit order (ticks never decrease)
+        # it repeats the values of DataManager.variables so that values(tick) is one gather instead of a bisect per var,
+        # and it has catch-up copies at the tick they were installed, where the version lists keep their commit tick
+        self.log_ticks = array('q')
+        self.log_vars = array('q')
+        self.log_values = array('q')
+        # values are kept in lists instead once one does not fit in 64 bits
+        self.wide = False
+
+    def _initial_values(self):
+        values = range(0, (self.num_vars + 1) * 10, 10)
+        if self.wide:
+            return list(values)
+        return array('q', values)
+
+    def _widen(self):
+        """ switch the value columns to lists that hold integers of any size """
+        self.wide = True
+        if self.latest_values is not None:
+            self.latest_values = list(self.latest_values)
+        self.log_values = list(self.log_values)
+        logging.info("Committed values no longer fit in 64 bits, using lists.")
+
+    def commit(self, var_index, tick, value):
+        """ record a new committed version """
+        if not self.wide and not INT64_MIN <= value <= INT64_MAX:
+            self._widen()
+        if self.latest_values is None:
+            self.latest_values = self._initial_values()
+        self.latest_values[var_index] = value
+        self.log_ticks.append(tick)
+        self.log_vars.append(var_index)
+        self.log_values.append(value)
+
+    def values(self, tick=None):
+        """ dense values of all variables (index = var index), latest or as of tick """
+        if tick is None:
+            if self.latest_values is None:
+                values = self._initial_values()
+            else:
+                values = self.latest_values
+            if np is not None and not self.wide:
+                return np.frombuffer(values, dtype=np.int64).copy()
+            return list(values)
+
+        num_commits = bisect_right(self.log_ticks, tick)
+        if np is None or self.wide:
+            values = list(self._initial_values())
+            for i in range(num_commits):
+                values[self.log_vars[i]] = self.log_values[i]
+            return values
+        values = np.arange(0, (self.num_vars + 1) * 10, 10, dtype=np.int64)
+        if num_commits == 0:
+            return values
+        log_vars = np.frombuffer(self.log_vars, dtype=np.int64)[:num_commits]
+        log_values = np.frombuffer(self.log_values, dtype=np.int64)[:num_commits]
+        # the last commit of each var wins
+        var_indexes, last = np.unique(log_vars[::-1], return_index=True)
+        values[var_indexes] = log_values[::-1][last]
+        return values
@@ -1,29 +1,83 @@
 import os
 import logging
+import math
+from bisect import bisect_right
 from enum import Enum
 from lock import Lock
 from inout import IO
+from committed_state import CommittedState
 
 NUM_VARS = 20
 
 class DataManager(object):
 
     VStatus = Enum("VStatus", ("Ready", "Unavailable", "Recovering"))
+    SiteState = Enum("SiteState", ("Up", "Down", "Recovered"))
 
-    def __init__(self, associated_site):
+    def __init__(self, associated_site, uptime):
         self.associated_site = associated_site
+        self.uptime = uptime
+        # versions of variables that have been written, untouched variables only have their initial version
         self.variables: {int: [()]} = {}
+        # latest committed values and commit log in columnar form, for dumps
+        self.committed = CommittedState(NUM_VARS)
+        self.managed_vars = None
         self.uncommitted_vars: {int: [()]} = {}
-        self.variable_status = {}
+        # status changes of single variables, only valid in the epoch they were made in
+        self.variable_status: {int: (int, VStatus)} = {}
         self.locktable = {}
-
-        # init variables and variable status
-        for i in range(1, NUM_VARS+1):
-            if i % 2 == 0 or i % 10 + 1 == associated_site:
-                self.variables[i] = []
-                self.variables[i].append((0, i * 10))
-                self.variable_status[i] = self.VStatus.Ready
-
+        # number of locks granted on this site so far
+        self.lock_grants = 0
+        # every fail / recover starts a new epoch
+        self.epoch = 0
+        self.site_state = self.SiteState.Up
+
+
+    def manages(self, var_index):
+        """ whether this site holds a copy of a variable """
+        return 1 <= var_index <= NUM_VARS and (var_index % 2 == 0 or var_index % 10 + 1 == self.associated_site)
+
+    def get_versions(self, var_index):
+        """ return the committed versions of a variable (do not modify) """
+        versions = self.variables.get(var_index)
+        if versions is None:
+            return [(0, var_index * 10)]
+        return versions
+
+    def get_managed_vars(self):
+        """ return the indexes of the variables this site holds, in order """
+        if self.managed_vars is None:
+            self.managed_vars = [i for i in range(1, NUM_VARS+1) if self.manages(i)]
+        return self.managed_vars
+
+    def _append_version(self, var_index, tick, value):
+        """ record a new committed version, materializing the version list on first write """
+        versions = self.variables.get(var_index)
+        if versions is None:
+            versions = [(0, var_index * 10)]
+            self.variables[var_index] = versions
+        versions.append((tick, value))
+        self.committed.commit(var_index, tick, value)
+
+    def get_var_status(self, var_index):
+        """ return the status of a variable at this site """
+        if not self.manages(var_index):
+            return None
+        status = self.variable_status.get(var_index)
+        if status is not None and status[0] == self.epoch:
+            return status[1]
+        if self.site_state == self.SiteState.Up:
+            return self.VStatus.Ready
+        if self.site_state == self.SiteState.Down:
+            return self.VStatus.Unavailable
+        # replicated vars are not readable until a new version is committed after recovery
+        if var_index % 2 == 0:
+            return self.VStatus.Recovering
+        return self.VStatus.Ready
+
+    def set_var_status(self, var_index, status):
+        """ change the status of a variable within the current epoch """
+        self.variable_status[var_index] = (self.epoch, status)
 
 
     def fail(self):
@@ -33,35 +87,31 @@ class DataManager(object):
         # wipe out uncommitted vars
         self.uncommitted_vars = {}
         # change variable status
-        for var_index in self.variable_status.keys():
-            self.variable_status[var_index] = self.VStatus.Unavailable
+        self.epoch += 1
+        self.site_state = self.SiteState.Down
         logging.info("Site %s fails." % (self.associated_site))
         
 
     def recover(self):
         """ when the corresponding site recovers """
         # change variable status
-        for var_index in self.variable_status.keys():
-            if var_index % 2 == 0:
-                self.variable_status[var_index] = self.VStatus.Recovering
-            else:
-                self.variable_status[var_index] = self.VStatus.Ready
+        self.epoch += 1
+        self.site_state = self.SiteState.Recovered
         logging.info("Site %s recovers." % (self.associated_site))
 
 
     def get_committed_var(self, var_index):
         """ get latest committed value of a variable """
         # if a var is ready return its value
-        if self.variable_status.get(var_index) == self.VStatus.Ready:
-            num_versions = len(self.variables.get(var_index))
-            return self.variables.get(var_index)[num_versions - 1][1]
+        if self.get_var_status(var_index) == self.VStatus.Ready:
+            return self.get_versions(var_index)[-1][1]
         return None
 
 
     def read(self, var_index, transaction_index):
         """ handles request to read a variable """
         # see if variable status ready (what if recovering?)
-        if self.variable_status.get(var_index) != self.VStatus.Ready:
+        if self.get_var_status(var_index) != self.VStatus.Ready:
             return False, []
 
         # try to acquire read lock
@@ -71,7 +121,6 @@ class DataManager(object):
             logging.info("T%s acquired read lock on x%s." % (transaction_index, var_index))
             value = self.get_committed_var(var_index)
             logging.info("Read x%s = %s from site %s by T%s." % (var_index, value, self.associated_site, transaction_index))
-            IO.print_var(var_index, value)
             return True, []
 
         # if cannot obtain lock
@@ -83,7 +132,7 @@ class DataManager(object):
 
     def write(self, var_index, value, transaction_index):
         """ handles request to write a variable """
-        assert(self.variable_status.get(var_index) != self.VStatus.Unavailable)
+        assert(self.get_var_status(var_index) != self.VStatus.Unavailable)
         # try to acquire write lock
         # if obtained lock, write (write value in transaction's uncommitted vars)
         success, blocking_transactions = self.acquire_write_lock(var_index, transaction_index)
@@ -98,13 +147,30 @@ class DataManager(object):
     def commit_var(self, var_index, value, tick):
         """ when a transaction commits, commit the uncommitted variable, record it as a new version """
         # update value in variables
-        self.variables[var_index].append((tick, value))
+        self._append_version(var_index, tick, value)
         logging.info("Commit x%s = %s to site %s at tick: %s." % (var_index, value, self.associated_site, tick))
         # if the var is recovering, update status
-        if self.variable_status.get(var_index) == self.VStatus.Recovering:
-            self.variable_status[var_index] = self.VStatus.Ready
+        if self.get_var_status(var_index) == self.VStatus.Recovering:
+            self.set_var_status(var_index, self.VStatus.Ready)
         
 
+    def catch_up_var(self, var_index, version, tick):
+        """ install the latest committed version of a recovering var, copied from another replica at tick """
+        if self.get_var_status(var_index) != self.VStatus.Recovering:
+            return False
+        var_versions = self.variables.get(var_index)
+        if var_versions is None:
+            var_versions = [(0, var_index * 10)]
+            self.variables[var_index] = var_versions
+        # the copy only misses versions committed while this site was down
+        if version[0] > var_versions[-1][0]:
+            var_versions.append(version)
+            self.committed.commit(var_index, tick, version[1])
+        self.set_var_status(var_index, self.VStatus.Ready)
+        logging.info("Caught up x%s = %s on site %s at tick: %s." % (var_index, version[1], self.associated_site, tick))
+        return True
+
+
     def acquire_read_lock(self, var_index, transaction_index):
         """ acquire read lock """
         # check lock table
@@ -113,10 +179,12 @@ class DataManager(object):
             new_lock = Lock(Lock.LockType.ReadLock)
             new_lock.transactions.append(transaction_index)
             self.locktable[var_index] = new_lock
+            self.lock_grants += 1
             return True, []
         elif current_lock.lock_type == Lock.LockType.ReadLock:
             if transaction_index not in current_lock.transactions:
                 self.locktable[var_index].transactions.append(transaction_index)
+                self.lock_grants += 1
             return True, []
         elif current_lock.lock_type == Lock.LockType.WriteLock:
             if current_lock.transactions[0] == transaction_index:
@@ -136,6 +204,7 @@ class DataManager(object):
             new_lock = Lock(Lock.LockType.WriteLock)
             new_lock.transactions.append(transaction_index)
             self.locktable[var_index] = new_lock
+            self.lock_grants += 1
             return True, []
         elif current_lock.lock_type == Lock.LockType.ReadLock and len(current_lock.transactions) == 1 and current_lock.transactions[0] == transaction_index:
             self.locktable[var_index].lock_type = Lock.LockType.WriteLock
@@ -180,36 +249,47 @@ class DataManager(object):
                     self.locktable.pop(var)
               
 
+    def get_lock_occupancy(self):
+        """ return the number of variables currently locked on this site """
+        return len(self.locktable)
+
     def get_lock_on_var(self, var_index):
         """ return the current lock on a var """
         return self.locktable.get(var_index)
 
 
 
-    def dump(self):
-        """ dump current variables on this site """
+    def dump(self, tick=None):
+        """ dump current variables on this site, or their committed values as of tick """
+        managed_vars = self.get_managed_vars()
+        values = self.dump_values(tick)
+        if not isinstance(values, list):
+            # gather the managed vars in one go
+            values = values[managed_vars].tolist()
+            return dict(zip(managed_vars, values))
         snapshot = {}
-        for var_index in self.variables.keys():
-            num_versions = len(self.variables.get(var_index))
-            snapshot[var_index] = self.variables.get(var_index)[num_versions - 1][1]
+        for var_index in managed_vars:
+            snapshot[var_index] = values[var_index]
         return snapshot
 
+    def dump_values(self, tick=None):
+        """ dense committed values of all variables (index = var index), including ones this site does not hold """
+        return self.committed.values(tick)
 
-    def read_from_snapshot(self, var_index, start_time, first_fail_time, last_fail_time, transaction_index):
-        """ multiversion read for RO transactions """
-        success = False
-        var_versions = self.variables.get(var_index)
-        num_versions = len(var_versions)
-        for version in range(num_versions-1, -1, -1):
-            tick = var_versions[version][0]
-            if tick <= start_time:
-                if first_fail_time is None or (first_fail_time > start_time) or last_fail_time < tick:
-                    success = True
-                    value = var_versions[version][1]
-                    IO.print_var(var_index, value)
-                    logging.info("Read x%s = %s from site %s by T%s." % (var_index, value, self.associated_site, transaction_index))
-                break
-        return success
+
+    def read_from_snapshot(self, var_index, start_time, transaction_index):
+        """ multiversion read for RO transactions, return whether it succeeded and the (tick, value) version read """
+        var_versions = self.get_versions(var_index)
+        # latest version committed no later than start_time
+        version = bisect_right(var_versions, (start_time, math.inf)) - 1
+        if version < 0:
+            return False, None
+        tick, value = var_versions[version]
+        # a replicated var is only valid if this site stayed up since the version was committed
+        if var_index % 2 == 0 and not self.uptime.up_between(tick, start_time):
+            return False, None
+        logging.info("Read x%s = %s from site %s by T%s." % (var_index, value, self.associated_site, transaction_index))
+        return True, var_versions[version]
 
 
     def write_uncommitted(self, var_index, value, transaction_index):
@@ -219,14 +299,17 @@ class DataManager(object):
         self.uncommitted_vars[transaction_index].append((var_index, value))
 
     def commit_vars(self, transaction_index, tick):
-        """ commit the uncommitted vars of a transaction """
+        """ commit the uncommitted vars of a transaction, return the committed (var, value) records """
         if self.uncommitted_vars.get(transaction_index) is None:
-            return
+            return []
         for uncommitted_record in self.uncommitted_vars[transaction_index]:
             var_index = uncommitted_record[0]
             value = uncommitted_record[1]
-            self.variables[var_index].append((tick, value))
-        self.uncommitted_vars.pop(transaction_index)
+            self._append_version(var_index, tick, value)
+            # if the var is recovering, it is up to date again
+            if self.get_var_status(var_index) == self.VStatus.Recovering:
+                self.set_var_status(var_index, self.VStatus.Ready)
+        return self.uncommitted_vars.pop(transaction_index)
 
     def abort_vars(self, transaction_index):
         """ discard the uncommitted vars of a transaction """
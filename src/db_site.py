@@ -2,6 +2,7 @@ import os
 import logging
 from enum import Enum
 from data_manager import DataManager
+from uptime_index import UptimeIndex
 
 class Site(object):
 
@@ -10,16 +11,18 @@ class Site(object):
     def __init__(self, index):
         self.index = index
         self.status = self.SStatus.Up
-        self.DM = DataManager(index)
-        self.first_access_time = {}
+        self.uptime = UptimeIndex()
+        self.DM = DataManager(index, self.uptime)
 
 
     def fail(self, tick):
         """ fail this site """
         self.DM.fail()
         self.status = self.SStatus.Down
+        self.uptime.record_fail(tick)
 
-    def recover(self):
+    def recover(self, tick):
         """ recover this site """
         self.DM.recover()
+        self.uptime.record_recover(tick)
         self.status = self.SStatus.Recovering
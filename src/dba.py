@@ -1,19 +1,69 @@
 from inout import IO
 from transaction_manager import TransactionManager
-import sys
+from trace_recorder import TraceRecorder
+from profiler import Profiler
+from history import HistoryRecorder
+from network_model import NetworkModel
+import argparse
+import cProfile
 
 
+parser = argparse.ArgumentParser(usage="python3 dba.py <inputfile> [--trace <tracefile>] [--profile <reportfile>] [--cprofile <statsfile>] [--dump-format npy|csv [--dump-prefix <prefix>]] [--read-policy <policy>] [--history <historyfile>] [--catch-up <vars per tick>] [--network <reportfile> [--latency <ms>] [--site-latency <site>=<ms> ...] [--bandwidth <bytes per ms>] [--jitter <ms>] [--network-seed <seed>]]")
+parser.add_argument("inputfile")
+parser.add_argument("--trace", metavar="tracefile", help="record a binary trace of lock, abort and commit decisions")
+parser.add_argument("--profile", metavar="reportfile", help="write per-phase cumulative time and call counts")
+parser.add_argument("--cprofile", metavar="statsfile", help="dump cProfile statistics of the whole run")
+parser.add_argument("--dump-format", choices=("npy", "csv"), help="export dump() to <prefix>_<tick>.<format> instead of printing it")
+parser.add_argument("--dump-prefix", default="dump", help="file prefix of exported dumps")
+parser.add_argument("--read-policy", choices=("first", "round-robin", "least-locked", "sticky"), default="first", help="how reads pick a replica of a replicated variable")
+parser.add_argument("--history", metavar="historyfile", help="record the reads and writes of committed transactions for check_history.py")
+parser.add_argument("--catch-up", type=int, default=0, metavar="vars", help="recovering sites copy up to this many replicated vars per tick from up to date replicas")
+parser.add_argument("--network", metavar="reportfile", help="simulate TM-DM messages and write messages and latency per transaction")
+parser.add_argument("--latency", type=float, default=1.0, metavar="ms", help="one way latency of a message")
+parser.add_argument("--site-latency", action="append", default=[], metavar="site=ms", help="one way latency of the messages of one site")
+parser.add_argument("--bandwidth", type=float, default=125000.0, metavar="bytes per ms", help="bandwidth of the links to the sites")
+parser.add_argument("--jitter", type=float, default=0.0, metavar="ms", help="add up to this much random delay to every message")
+parser.add_argument("--network-seed", type=int, default=0, metavar="seed", help="seed of the jitter")
+args = parser.parse_args()
 
-if len(sys.argv) < 2:
-    print("Usage: python3 dba.py <inputfile>")
-    sys.exit()
+site_latency = {}
+for entry in args.site_latency:
+    site_index, separator, latency = entry.partition("=")
+    if separator == "" or not site_index.isdigit():
+        parser.error("--site-latency expects <site>=<ms>, got %s" % entry)
+    site_latency[int(site_index)] = float(latency)
 
-filename = sys.argv[1]
+read_policies = {
+    "first": TransactionManager.ReadPolicy.First,
+    "round-robin": TransactionManager.ReadPolicy.RoundRobin,
+    "least-locked": TransactionManager.ReadPolicy.LeastLocked,
+    "sticky": TransactionManager.ReadPolicy.Sticky,
+}
 
-io = IO(filename)
-tm = TransactionManager()
+io = IO(args.inputfile)
+recorder = TraceRecorder() if args.trace else None
+profiler = Profiler() if args.profile else None
+history = HistoryRecorder() if args.history else None
+network = NetworkModel(args.latency, site_latency, args.bandwidth, args.jitter, args.network_seed) if args.network else None
+tm = TransactionManager(recorder, profiler, args.dump_format, args.dump_prefix, read_policies[args.read_policy], history=history, catch_up_batch=args.catch_up, network=network)
+
+if args.cprofile:
+    cprofiler = cProfile.Profile()
+    cprofiler.enable()
 
 op = io.get_op()
 
 while tm.execute(op):
     op = io.get_op()
+
+if args.cprofile:
+    cprofiler.disable()
+    cprofiler.dump_stats(args.cprofile)
+if recorder is not None:
+    recorder.save(args.trace)
+if profiler is not None:
+    profiler.save(args.profile)
+if history is not None:
+    history.save(args.history)
+if network is not None:
+    network.save(args.network)
@@ -0,0 +1,174 @@
+import os
+import logging
+import struct
+from bisect import bisect_right
+from enum import Enum
+
+# magic + format version, followed by fixed-size records
+HISTORY_HEADER = b"RCHI\x02"
+# op type, transaction, variable, commit number (of the version read for reads, of the transaction for commits)
+RECORD_FORMAT = struct.Struct("<Biii")
+
+
+class HistoryRecorder(object):
+    """ records the reads and writes of committed transactions
+
+    Commits are numbered in commit order, starting at 1, and a version is identified by the number
+    of the commit that wrote it (0: initial value). Several transactions can commit in the same tick.
+    """
+
+    OpType = Enum("OpType", ('Read', 'Write', 'Commit'))
+
+    def __init__(self):
+        self.records = bytearray()
+        self.num_committed = 0
+        # (var, tick) -> number of the last commit that wrote the var at that tick, as the DMs identify versions by tick
+        self.version_commit: {(int, int): int} = {}
+        # ops of transactions that have not finished yet
+        self.pending: {int: [tuple]} = {}
+        logging.info("History recorder initialized.")
+
+    def read(self, transaction_index, var_index, version_tick):
+        """ a transaction read the version of a var committed at version_tick (0: initial value) """
+        # the latest version committed at a tick is the one a read sees; -1 if no recorded commit wrote it
+        version = 0 if version_tick == 0 else self.version_commit.get((var_index, version_tick), -1)
+        self.pending.setdefault(transaction_index, []).append((self.OpType.Read.value, transaction_index, var_index, version))
+
+    def write(self, transaction_index, var_index):
+        """ a transaction wrote a var """
+        self.pending.setdefault(transaction_index, []).append((self.OpType.Write.value, transaction_index, var_index, 0))
+
+    def commit(self, transaction_index, tick):
+        """ keep the ops of a committed transaction, its writes become the versions committed at tick """
+        self.num_committed += 1
+        for record in self.pending.pop(transaction_index, []):
+            self.records += RECORD_FORMAT.pack(*record)
+            if record[0] == self.OpType.Write.value:
+                self.version_commit[(record[2], tick)] = self.num_committed
+        self.records += RECORD_FORMAT.pack(self.OpType.Commit.value, transaction_index, 0, self.num_committed)
+
+    def abort(self, transaction_index):
+        """ forget the ops of an aborted transaction """
+        self.pending.pop(transaction_index, None)
+
+    def save(self, filename):
+        """ write the binary history to a file """
+        with open(filename, 'wb') as file:
+            file.write(HISTORY_HEADER)
+            file.write(self.records)
+        logging.info("Saved history of %s committed transactions to %s." % (self.num_committed, filename))
+
+    @classmethod
+    def load(cls, filename):
+        """ read the raw records of a binary history file """
+        with open(filename, 'rb') as file:
+            data = file.read()
+        if not data.startswith(HISTORY_HEADER):
+            raise ValueError("%s is not a history file." % filename)
+        records = data[len(HISTORY_HEADER):]
+        if len(records) % RECORD_FORMAT.size != 0:
+            raise ValueError("History file %s is truncated." % filename)
+        return records
+
+
+class HistoryChecker(object):
+    """ checks that a recorded history is conflict-serializable w.r.t. its version order """
+
+    def __init__(self, records):
+        self.records = records
+        # committed transactions are identified by their commit number
+        self.transaction_at = {} # commit number -> transaction index
+        self.reads: {int: [(int, int)]} = {} # commit number -> [(var, commit number of the version read)]
+        self.writes: {int: set()} = {} # commit number -> vars written
+        self.versions: {int: [int]} = {} # var -> commit numbers of its versions, in version order
+        self.num_ops = 0
+        self.violations = []
+
+    def _load(self):
+        reads = []
+        writes = set()
+        Read = HistoryRecorder.OpType.Read.value
+        Write = HistoryRecorder.OpType.Write.value
+        for op_type, transaction_index, var_index, number in RECORD_FORMAT.iter_unpack(self.records):
+            self.num_ops += 1
+            if op_type == Read:
+                reads.append((var_index, number))
+            elif op_type == Write:
+                writes.add(var_index)
+            else:
+                if number in self.transaction_at:
+                    self.violations.append("T%s and T%s both have commit number %s." % (self.transaction_at[number], transaction_index, number))
+                self.transaction_at[number] = transaction_index
+                self.reads[number] = reads
+                self.writes[number] = writes
+                for var_index in writes:
+                    self.versions.setdefault(var_index, []).append(number)
+                reads = []
+                writes = set()
+        for var_versions in self.versions.values():
+            var_versions.sort()
+
+    def _build_graph(self):
+        """ multiversion conflict graph: wr, ww (version order) and rw edges between committed transactions """
+        graph = {node: [] for node in self.transaction_at}
+        for var_index, var_versions in self.versions.items():
+            for i in range(len(var_versions) - 1):
+                graph[var_versions[i]].append((var_versions[i+1], "ww", var_index))
+        for reader, reads in self.reads.items():
+            for var_index, version in reads:
+                var_versions = self.versions.get(var_index, [])
+                if version != 0:
+                    if version not in self.writes or var_index not in self.writes[version]:
+                        self.violations.append("T%s read a version of x%s that no committed transaction wrote." % (self.transaction_at[reader], var_index))
+                        continue
+                    if version != reader:
+                        graph[version].append((reader, "wr", var_index))
+                # the next version of the var must come after the reader
+                next_version = bisect_right(var_versions, version)
+                if next_version < len(var_versions) and var_versions[next_version] != reader:
+                    graph[reader].append((var_versions[next_version], "rw", var_index))
+        return graph
+
+    def _find_cycle(self, graph):
+        """ topological sort, return a cycle [(node, kind, var)] if there is one """
+        in_degree = {node: 0 for node in graph}
+        for node in graph:
+            for next_node, kind, var_index in graph[node]:
+                in_degree[next_node] += 1
+        ready = [node for node in graph if in_degree[node] == 0]
+        while ready:
+            node = ready.pop()
+            for next_node, kind, var_index in graph[node]:
+                in_degree[next_node] -= 1
+                if in_degree[next_node] == 0:
+                    ready.append(next_node)
+        remaining = [node for node in graph if in_degree[node] > 0]
+        if len(remaining) == 0:
+            return None
+        # every remaining node has a predecessor that remains, walk backwards until a node repeats
+        predecessor = {}
+        for node in remaining:
+            for next_node, kind, var_index in graph[node]:
+                if in_degree[next_node] > 0 and next_node not in predecessor:
+                    predecessor[next_node] = (node, kind, var_index)
+        visited = {}
+        path = []
+        node = remaining[0]
+        while node not in visited:
+            visited[node] = len(path)
+            previous = predecessor[node]
+            path.append(previous)
+            node = previous[0]
+        cycle = path[visited[node]:]
+        cycle.reverse()
+        return cycle
+
+    def check(self):
+        """ return a list of violations, empty if the history is serializable """
+        self._load()
+        graph = self._build_graph()
+        cycle = self._find_cycle(graph)
+        if cycle is not None:
+            steps = ["T%s -%s(x%s)->" % (self.transaction_at[node], kind, var_index) for node, kind, var_index in cycle]
+            self.violations.append("Conflict cycle: %s T%s" % (" ".join(steps), self.transaction_at[cycle[0][0]]))
+        return self.violations
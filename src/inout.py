@@ -1,4 +1,13 @@
 import logging
+import csv
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# largest magnitude up to which float64 holds every integer
+FLOAT_EXACT_LIMIT = 2**53
 
 class IO(object):
 
@@ -42,4 +51,46 @@ class IO(object):
             for var_index in site_snapshot[site_index].keys():
                 print("x%s: %s, " % (var_index, site_snapshot[site_index][var_index]), end='')
             print('\n')
+
+    @classmethod
+    def _fits_float(cls, values, managed_vars):
+        """ whether the values of the held vars are integers that float64 represents exactly """
+        if np is not None and isinstance(values, np.ndarray):
+            held = values[managed_vars]
+            return len(held) == 0 or (held.min() >= -FLOAT_EXACT_LIMIT and held.max() <= FLOAT_EXACT_LIMIT)
+        # values that do not fit in 64 bits are kept in lists
+        return all(-FLOAT_EXACT_LIMIT <= values[var_index] <= FLOAT_EXACT_LIMIT for var_index in managed_vars)
+
+    @classmethod
+    def export_dump(cls, filename, dump_format, site_states, num_vars):
+        """ write the committed values of all sites to a file, one row per site and one column per variable
+            site_states: [(site index, indexes of the vars held by the site, dense values indexed by var)] """
+        if dump_format == "npy":
+            if np is None:
+                raise ImportError("numpy is required for the npy dump format.")
+            if all(cls._fits_float(values, managed_vars) for site_index, managed_vars, values in site_states):
+                # copies a site does not hold are NaN
+                table = np.full((len(site_states), num_vars), np.nan)
+                for row, (site_index, managed_vars, values) in enumerate(site_states):
+                    table[row, np.asarray(managed_vars) - 1] = np.asarray(values)[managed_vars]
+            else:
+                # exact integers in an object table, copies a site does not hold are None (load with allow_pickle=True)
+                table = np.full((len(site_states), num_vars), None, dtype=object)
+                for row, (site_index, managed_vars, values) in enumerate(site_states):
+                    for var_index in managed_vars:
+                        table[row, var_index - 1] = int(values[var_index])
+            np.save(filename, table)
+        elif dump_format == "csv":
+            with open(filename, 'w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(["site"] + ["x%s" % i for i in range(1, num_vars+1)])
+                for site_index, managed_vars, values in site_states:
+                    row = [""] * (num_vars + 1)
+                    row[0] = site_index
+                    for var_index in managed_vars:
+                        row[var_index] = values[var_index]
+                    writer.writerow(row)
+        else:
+            raise ValueError("Unknown dump format %s." % dump_format)
+        logging.info("Exported dump of %s sites to %s." % (len(site_states), filename))
             
@@ -0,0 +1,172 @@
+import os
+import logging
+import inspect
+import functools
+import random
+
+# TM -> DM requests, each costs a request and a reply message
+# (the TM's peeks at lock tables and versions stand for state it would learn from these replies)
+NETWORK_DM_CALLS = ('read', 'write', 'try_write_lock', 'acquire_read_lock', 'acquire_write_lock', 'release_all_locks', 'commit_vars', 'abort_vars', 'read_from_snapshot')
+# bytes of a message without its payload
+MESSAGE_HEADER_SIZE = 32
+
+
+class NetworkModel(object):
+    """ simulated cost of the messages between the TM and the DMs
+
+    A message to or from a site takes the latency of the site plus its size over the bandwidth, plus up to jitter.
+    Within an op the TM sends each kind of request to all its sites in parallel and waits for the slowest reply
+    before sending the next kind, so an op costs one round trip per kind of request it sends.
+    """
+
+    def __init__(self, latency=1.0, site_latency=None, bandwidth=125000.0, jitter=0.0, seed=0):
+        self.latency = latency # ms, one way
+        self.site_latency: {int: float} = dict(site_latency) if site_latency is not None else {} # site index -> ms
+        self.bandwidth = bandwidth # bytes per ms
+        self.jitter = jitter # ms
+        self.rng = random.Random(seed)
+        self.serving = False
+        # round trips of the current op: transaction -> request kind -> site -> ms
+        self.pending: {int: {str: {int: float}}} = {}
+        self.ending: {int: bool} = {} # transactions that finish in the current op -> committed
+        # per transaction
+        self.messages: {int: int} = {}
+        self.bytes: {int: int} = {}
+        self.rounds: {int: int} = {}
+        self.network_time: {int: float} = {}
+        self.end_latency: {int: float} = {}
+        self.committed: {int: bool} = {}
+        self.order = []
+        # per site and per request kind
+        self.site_messages: {int: int} = {}
+        self.call_messages: {str: int} = {}
+        self.call_time: {str: float} = {}
+        self.call_rounds: {str: int} = {}
+        self.call_round_time: {str: float} = {} # time the transactions waited for rounds of this kind
+        logging.info("Network model initialized.")
+
+    def connect(self, dm, site_index, method_names=NETWORK_DM_CALLS):
+        """ replace the request methods of a DM by wrappers that charge their messages """
+        for method_name in method_names:
+            method = getattr(dm, method_name)
+            setattr(dm, method_name, self._sent(site_index, method_name, method))
+
+    def _sent(self, site_index, method_name, method):
+        signature = inspect.signature(method)
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            # a DM serving a request may call its own request methods, those are not messages
+            if self.serving:
+                return method(*args, **kwargs)
+            self.serving = True
+            try:
+                result = method(*args, **kwargs)
+            finally:
+                self.serving = False
+            arguments = signature.bind(*args, **kwargs).arguments
+            self.send(arguments['transaction_index'], site_index, method_name, self._size(args) + self._size(kwargs), self._size(result))
+            return result
+        return wrapper
+
+    @classmethod
+    def _size(cls, payload):
+        """ rough encoded size of a payload in bytes """
+        if payload is None:
+            return 0
+        if isinstance(payload, bool):
+            return 1
+        if isinstance(payload, (int, float)):
+            return 8
+        if isinstance(payload, str):
+            return len(payload)
+        if isinstance(payload, dict):
+            return sum(cls._size(key) + cls._size(value) for key, value in payload.items())
+        if isinstance(payload, (list, tuple, set)):
+            return sum(cls._size(item) for item in payload)
+        return 8
+
+    def _one_way(self, site_index, size):
+        """ simulated time of one message in ms """
+        delay = self.site_latency.get(site_index, self.latency) + (MESSAGE_HEADER_SIZE + size) / self.bandwidth
+        if self.jitter > 0:
+            delay += self.rng.uniform(0, self.jitter)
+        return delay
+
+    def _track(self, transaction_index):
+        if transaction_index not in self.messages:
+            self.messages[transaction_index] = 0
+            self.bytes[transaction_index] = 0
+            self.rounds[transaction_index] = 0
+            self.network_time[transaction_index] = 0.0
+            self.order.append(transaction_index)
+
+    def send(self, transaction_index, site_index, method_name, request_size, reply_size):
+        """ charge a request and its reply to a transaction """
+        elapsed = self._one_way(site_index, request_size) + self._one_way(site_index, reply_size)
+        self._track(transaction_index)
+        self.messages[transaction_index] += 2
+        self.bytes[transaction_index] += 2 * MESSAGE_HEADER_SIZE + request_size + reply_size
+        self.site_messages[site_index] = self.site_messages.get(site_index, 0) + 2
+        self.call_messages[method_name] = self.call_messages.get(method_name, 0) + 2
+        self.call_time[method_name] = self.call_time.get(method_name, 0.0) + elapsed
+        requests = self.pending.setdefault(transaction_index, {}).setdefault(method_name, {})
+        requests[site_index] = requests.get(site_index, 0.0) + elapsed
+
+    def finish(self, transaction_index, committed):
+        """ a transaction commits or aborts in the current op """
+        self.ending[transaction_index] = committed
+
+    def end_op(self):
+        """ close the rounds of the current op """
+        for transaction_index, requests in self.pending.items():
+            op_time = 0.0
+            for method_name, requests_per_site in requests.items():
+                round_time = max(requests_per_site.values())
+                self.call_rounds[method_name] = self.call_rounds.get(method_name, 0) + 1
+                self.call_round_time[method_name] = self.call_round_time.get(method_name, 0.0) + round_time
+                op_time += round_time
+            self.network_time[transaction_index] += op_time
+            self.rounds[transaction_index] += len(requests)
+            if transaction_index in self.ending:
+                self.end_latency[transaction_index] = op_time
+        for transaction_index, committed in self.ending.items():
+            self.committed[transaction_index] = committed
+            self.end_latency.setdefault(transaction_index, 0.0)
+            self._track(transaction_index)
+        self.pending.clear()
+        self.ending.clear()
+
+    def commit_latencies(self):
+        """ simulated time of the commit op of every committed transaction """
+        return [self.end_latency[t] for t in self.order if self.committed.get(t)]
+
+    def report(self):
+        """ return messages and simulated network time per transaction, site and request kind """
+        lines = ["%-12s %-10s %10s %10s %8s %14s %12s" % ("transaction", "status", "messages", "bytes", "rounds", "network (ms)", "commit (ms)")]
+        for t in sorted(self.order):
+            if t in self.committed:
+                status = "committed" if self.committed[t] else "aborted"
+            else:
+                status = "active"
+            commit = "%12.3f" % self.end_latency[t] if self.committed.get(t) else "%12s" % "-"
+            lines.append("%-12s %-10s %10d %10d %8d %14.3f %s" % ("T%s" % t, status, self.messages[t], self.bytes[t], self.rounds[t], self.network_time[t], commit))
+        commit_latencies = self.commit_latencies()
+        if len(commit_latencies) != 0:
+            lines.append("")
+            lines.append("commit latency (ms): mean %.3f, max %.3f over %s committed transactions" % (sum(commit_latencies) / len(commit_latencies), max(commit_latencies), len(commit_latencies)))
+        lines.append("")
+        lines.append("%-20s %10s %14s %8s %16s" % ("request", "messages", "time (ms)", "rounds", "round time (ms)"))
+        for method_name in NETWORK_DM_CALLS:
+            if method_name in self.call_messages:
+                lines.append("%-20s %10d %14.3f %8d %16.3f" % (method_name, self.call_messages[method_name], self.call_time[method_name], self.call_rounds[method_name], self.call_round_time[method_name]))
+        lines.append("")
+        lines.append("%-20s %10s" % ("site", "messages"))
+        for site_index in sorted(self.site_messages):
+            lines.append("%-20s %10d" % ("site %s" % site_index, self.site_messages[site_index]))
+        return "\n".join(lines) + "\n"
+
+    def save(self, filename):
+        """ write the report to a file """
+        with open(filename, 'w') as file:
+            file.write(self.report())
+        logging.info("Saved network report to %s." % filename)
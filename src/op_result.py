@@ -0,0 +1,20 @@
+import os
+import logging
+from enum import Enum
+
+class OpResult(object):
+
+    # Done: the op took effect; Blocked: waiting in the retry queue, updated in place once it completes or its transaction aborts;
+    # Aborted: the transaction was aborted (see abort_cause); Ignored: the transaction was not active
+    OStatus = Enum("OStatus", ('Done', 'Blocked', 'Aborted', 'Ignored'))
+
+    def __init__(self, op):
+        self.op = op
+        self.status = self.OStatus.Done
+        self.value = None # value read, or {site: {var: value}} for dump
+        self.abort_cause = None
+
+    def __repr__(self):
+        if self.status == self.OStatus.Aborted:
+            return "OpResult(%s, %s, %s)" % (self.op, self.status.name, self.abort_cause.name)
+        return "OpResult(%s, %s, %s)" % (self.op, self.status.name, self.value)
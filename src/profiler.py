@@ -0,0 +1,63 @@
+import os
+import logging
+import functools
+from contextlib import contextmanager
+from time import perf_counter
+
+
+class Profiler(object):
+
+    def __init__(self):
+        self.total_time = {}
+        self.call_count = {}
+        self.order = []
+        logging.info("Profiler initialized.")
+
+    def add(self, name, elapsed):
+        """ accumulate the time spent in a phase or call """
+        if name not in self.total_time:
+            self.total_time[name] = 0.0
+            self.call_count[name] = 0
+            self.order.append(name)
+        self.total_time[name] += elapsed
+        self.call_count[name] += 1
+
+    @contextmanager
+    def phase(self, name):
+        """ time a block of code """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, perf_counter() - start)
+
+    def instrument(self, obj, method_names, prefix):
+        """ replace methods of an object by timed wrappers """
+        for method_name in method_names:
+            method = getattr(obj, method_name)
+            setattr(obj, method_name, self._timed(prefix + method_name, method))
+
+    def _timed(self, name, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.add(name, perf_counter() - start)
+        return wrapper
+
+    def report(self):
+        """ return the cumulative time and call count of every phase and call """
+        lines = ["%-30s %10s %14s %14s" % ("phase", "calls", "total (s)", "per call (us)")]
+        for name in self.order:
+            total = self.total_time[name]
+            count = self.call_count[name]
+            lines.append("%-30s %10d %14.6f %14.3f" % (name, count, total, total / count * 1e6))
+        return "\n".join(lines) + "\n"
+
+    def save(self, filename):
+        """ write the report to a file """
+        with open(filename, 'w') as file:
+            file.write(self.report())
+        logging.info("Saved profile to %s." % filename)
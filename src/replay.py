@@ -0,0 +1,63 @@
+from inout import IO
+from transaction_manager import TransactionManager
+from trace_recorder import TraceRecorder, TraceVerifier, TraceDivergence, RECORD_FORMAT
+import argparse
+import contextlib
+import os
+import sys
+
+
+def replay(inputfile, tracefile):
+    """ re-run an input and return the first divergence from the recorded trace (None if identical) """
+    verifier = TraceVerifier(TraceRecorder.load(tracefile))
+    # run with the options the trace was recorded with
+    options = TraceRecorder.load_options(tracefile)
+    read_policy = TransactionManager.ReadPolicy[options.get('read_policy', 'First')]
+    io = IO(inputfile)
+    catch_up_batch = int(options.get('catch_up_batch', 0))
+    tm = TransactionManager(verifier, read_policy=read_policy, catch_up_batch=catch_up_batch)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            op = io.get_op()
+            while tm.execute(op):
+                op = io.get_op()
+            verifier.finish()
+        except TraceDivergence as divergence:
+            return divergence
+    return None
+
+
+def diff(tracefile_a, tracefile_b):
+    """ compare two recorded traces and return the first divergence (None if identical) """
+    records_a = TraceRecorder.load(tracefile_a)
+    records_b = TraceRecorder.load(tracefile_b)
+    record_index = TraceRecorder.first_divergence(records_a, records_b)
+    if record_index is None:
+        return None
+    expected = None
+    actual = None
+    if record_index < len(records_a) // RECORD_FORMAT.size:
+        expected = TraceRecorder.unpack(records_a, record_index)
+    if record_index < len(records_b) // RECORD_FORMAT.size:
+        actual = TraceRecorder.unpack(records_b, record_index)
+    ticks = [fields[0] for fields in (expected, actual) if fields is not None]
+    return TraceDivergence(min(ticks), expected, actual)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="python3 replay.py <inputfile> <tracefile>\n       python3 replay.py --diff <tracefile> <tracefile>")
+    parser.add_argument("first")
+    parser.add_argument("second")
+    parser.add_argument("--diff", action="store_true", help="compare two recorded traces instead of replaying an input")
+    args = parser.parse_args()
+
+    if args.diff:
+        divergence = diff(args.first, args.second)
+    else:
+        divergence = replay(args.first, args.second)
+
+    if divergence is None:
+        print("Traces match.")
+        sys.exit(0)
+    print(divergence)
+    sys.exit(1)
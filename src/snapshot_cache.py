@@ -0,0 +1,40 @@
+import os
+import logging
+
+
+class SnapshotCache(object):
+    """ resolved snapshot reads shared by read-only transactions that see the same snapshot """
+
+    def __init__(self):
+        self.snapshots: {int: {int: (int, int, int)}} = {} # snapshot tick -> var -> (value, site index, version tick)
+        self.ref_count: {int: int} = {}
+
+    def acquire(self, snapshot_time):
+        """ a read-only transaction starts using a snapshot """
+        if snapshot_time not in self.snapshots:
+            self.snapshots[snapshot_time] = {}
+            self.ref_count[snapshot_time] = 0
+        self.ref_count[snapshot_time] += 1
+
+    def release(self, snapshot_time):
+        """ a read-only transaction finishes, evict the snapshot once nobody uses it """
+        if snapshot_time not in self.ref_count:
+            return
+        self.ref_count[snapshot_time] -= 1
+        if self.ref_count[snapshot_time] == 0:
+            self.ref_count.pop(snapshot_time)
+            self.snapshots.pop(snapshot_time)
+            logging.info("Evicted snapshot at tick %s." % snapshot_time)
+
+    def get(self, snapshot_time, var_index):
+        """ return (value, site index, version tick) of a resolved read, or None """
+        snapshot = self.snapshots.get(snapshot_time)
+        if snapshot is None:
+            return None
+        return snapshot.get(var_index)
+
+    def put(self, snapshot_time, var_index, value, site_index, version_tick):
+        """ memoize a resolved read """
+        snapshot = self.snapshots.get(snapshot_time)
+        if snapshot is not None:
+            snapshot[var_index] = (value, site_index, version_tick)
@@ -0,0 +1,152 @@
+import os
+import logging
+import struct
+from enum import Enum
+from transaction import Transaction
+
+# magic + format version, then the run options and fixed-size records
+TRACE_HEADER = b"RCTR\x03"
+# length of the options, stored as "key=value;key=value"
+OPTIONS_LENGTH_FORMAT = struct.Struct("<H")
+# tick, event type, code, transaction, variable, site, value (values may need 64 bits)
+RECORD_FORMAT = struct.Struct("<IBBiiiq")
+
+
+def fold_value(value):
+    """ map a value that does not fit in 64 bits onto the int64 range, equal values stay equal """
+    return (value + 2**63) % 2**64 - 2**63
+
+
+class TraceDivergence(Exception):
+
+    def __init__(self, tick, expected, actual):
+        self.tick = tick
+        self.expected = expected
+        self.actual = actual
+        super().__init__("Trace diverges at tick %s: expected %s, got %s." % (tick, TraceRecorder.describe(expected), TraceRecorder.describe(actual)))
+
+
+class TraceRecorder(object):
+
+    EventType = Enum("EventType", ('LockGrant', 'QueueInsert', 'Abort', 'Commit', 'CommitVersion'))
+    AbortCause = Transaction.AbortCause
+
+    def __init__(self):
+        self.records = bytearray()
+        self.num_records = 0
+        # TM options that change its decisions, replay reapplies them
+        self.options: {str: str} = {}
+        logging.info("Trace recorder initialized.")
+
+    def record(self, tick, event_type, code=0, transaction_index=0, var_index=0, site_index=0, value=0):
+        """ append one decision to the trace """
+        self.records += RECORD_FORMAT.pack(tick, event_type.value, code, transaction_index, var_index, site_index, fold_value(value))
+        self.num_records += 1
+
+    def save(self, filename):
+        """ write the binary trace to a file """
+        with open(filename, 'wb') as file:
+            file.write(TRACE_HEADER)
+            options = ";".join("%s=%s" % (key, value) for key, value in self.options.items()).encode()
+            file.write(OPTIONS_LENGTH_FORMAT.pack(len(options)))
+            file.write(options)
+            file.write(self.records)
+        logging.info("Saved %s trace records to %s." % (self.num_records, filename))
+
+    @classmethod
+    def _read(cls, filename):
+        """ return the options and raw records of a binary trace file """
+        with open(filename, 'rb') as file:
+            data = file.read()
+        if not data.startswith(TRACE_HEADER):
+            raise ValueError("%s is not a trace file." % filename)
+        offset = len(TRACE_HEADER)
+        if len(data) < offset + OPTIONS_LENGTH_FORMAT.size:
+            raise ValueError("Trace file %s is truncated." % filename)
+        options_length, = OPTIONS_LENGTH_FORMAT.unpack_from(data, offset)
+        offset += OPTIONS_LENGTH_FORMAT.size
+        options = {}
+        for entry in data[offset:offset+options_length].decode().split(";"):
+            if entry:
+                key, value = entry.split("=", 1)
+                options[key] = value
+        records = data[offset+options_length:]
+        if len(records) % RECORD_FORMAT.size != 0:
+            raise ValueError("Trace file %s is truncated." % filename)
+        return options, records
+
+    @classmethod
+    def load(cls, filename):
+        """ read the raw records of a binary trace file """
+        return cls._read(filename)[1]
+
+    @classmethod
+    def load_options(cls, filename):
+        """ read the TM options a trace was recorded with """
+        return cls._read(filename)[0]
+
+    @classmethod
+    def unpack(cls, records, record_index):
+        """ return the fields of a single record """
+        return RECORD_FORMAT.unpack_from(records, record_index * RECORD_FORMAT.size)
+
+    @classmethod
+    def describe(cls, fields):
+        """ human readable form of a record """
+        if fields is None:
+            return "end of trace"
+        tick, event_type, code, transaction_index, var_index, site_index, value = fields
+        event_type = cls.EventType(event_type)
+        if event_type == cls.EventType.LockGrant or event_type == cls.EventType.QueueInsert:
+            lock_type = "read" if code == 1 else "write"
+            return "%s %s lock T%s x%s site %s" % (event_type.name, lock_type, transaction_index, var_index, site_index)
+        if event_type == cls.EventType.Abort:
+            return "Abort T%s (%s)" % (transaction_index, cls.AbortCause(code).name)
+        if event_type == cls.EventType.Commit:
+            return "Commit T%s" % transaction_index
+        return "CommitVersion T%s x%s = %s at site %s" % (transaction_index, var_index, value, site_index)
+
+    @classmethod
+    def first_divergence(cls, records_a, records_b):
+        """ return the index of the first differing record of two traces, or None if identical """
+        if records_a == records_b:
+            return None
+        # compare in large blocks and only look at single records inside the differing block
+        size = RECORD_FORMAT.size
+        block = size * 4096
+        length = min(len(records_a), len(records_b))
+        offset = 0
+        while offset < length and records_a[offset:offset+block] == records_b[offset:offset+block]:
+            offset += block
+        record_index = offset // size
+        while (record_index + 1) * size <= length:
+            start = record_index * size
+            if records_a[start:start+size] != records_b[start:start+size]:
+                return record_index
+            record_index += 1
+        return record_index
+
+
+class TraceVerifier(TraceRecorder):
+
+    def __init__(self, expected_records):
+        super().__init__()
+        self.expected_records = expected_records
+        self.num_expected = len(expected_records) // RECORD_FORMAT.size
+
+    def record(self, tick, event_type, code=0, transaction_index=0, var_index=0, site_index=0, value=0):
+        """ compare the decision against the recorded trace, stop at the first mismatch """
+        actual = (tick, event_type.value, code, transaction_index, var_index, site_index, fold_value(value))
+        expected = None
+        if self.num_records < self.num_expected:
+            expected = self.unpack(self.expected_records, self.num_records)
+        if actual != expected:
+            diverged_tick = tick if expected is None else min(tick, expected[0])
+            raise TraceDivergence(diverged_tick, expected, actual)
+        super().record(tick, event_type, code, transaction_index, var_index, site_index, value)
+
+    def finish(self):
+        """ make sure no recorded decision is missing from the replay """
+        if self.num_records < self.num_expected:
+            expected = self.unpack(self.expected_records, self.num_records)
+            raise TraceDivergence(expected[0], expected, None)
@@ -5,6 +5,7 @@ from enum import Enum
 class Transaction(object):
 
     TStatus = Enum("TStatus", ('Running', 'Blocked', 'Committed', 'Aborted'))
+    AbortCause = Enum("AbortCause", ('Deadlock', 'SiteFailure', 'NoSnapshot'))
 
     def __init__(self, index, read_only, start_time):
         self.index = index
@@ -12,8 +13,15 @@ class Transaction(object):
         self.status = self.TStatus.Running
         self.read_only = read_only
         self.start_time = start_time
+        self.first_access_time = {} # site index -> tick of the first access
+        self.snapshot_time = None # RO only: last tick up to start_time (the begin tick included) at which committed state or site status changed
 
     def write_uncommitted(self, var_index, value):
         """ store write value in transaction """
         self.uncommitted_vars[var_index] = value
         logging.info("Write x%s = %s to uncommitted variables in T%s." % (var_index, value, self.index))
+
+    def record_access(self, site_index, tick):
+        """ record the first time this transaction accesses a site """
+        if site_index not in self.first_access_time:
+            self.first_access_time[site_index] = tick
@@ -1,11 +1,17 @@
 import os
 import logging
 import time
+from collections import deque
+from enum import Enum
+from contextlib import nullcontext
 from inout import IO
 from db_site import Site
 from transaction import Transaction
 from lock import Lock
 from data_manager import DataManager
+from trace_recorder import TraceRecorder
+from snapshot_cache import SnapshotCache
+from op_result import OpResult
 
 
 logging.basicConfig(level=logging.INFO,
@@ -17,21 +23,60 @@ logging.basicConfig(level=logging.INFO,
 
 NUM_VARS = 20
 NUM_SITES = 10
+PROFILED_DM_CALLS = ('read', 'try_write_lock', 'release_all_locks', 'commit_vars', 'read_from_snapshot')
 
 class TransactionManager(object):
 
-    def __init__(self):
+    # how _read picks the replica of a replicated variable
+    ReadPolicy = Enum("ReadPolicy", ('First', 'RoundRobin', 'LeastLocked', 'Sticky'))
+
+    def __init__(self, recorder=None, profiler=None, dump_format=None, dump_prefix="dump", read_policy=None, echo=True, history=None, catch_up_batch=0, network=None):
         self.global_time = 0
-        self.transactions = {}
-        self.op_retry_queue = {}
+        self.history = history
+        # print reads, dumps, commits and aborts to stdout
+        self.echo = echo
+        self.recorder = recorder
+        self.profiler = profiler
+        # charges simulated message costs of TM -> DM requests to transactions
+        self.network = network
+        # export dumps to files (npy or csv) instead of printing them
+        self.dump_format = dump_format
+        self.dump_prefix = dump_prefix
+        self.read_policy = read_policy if read_policy is not None else self.ReadPolicy.First
+        if self.recorder is not None:
+            self.recorder.options['read_policy'] = self.read_policy.name
+        self.round_robin_next = 0
+        self.transactions = {} # active transactions only, finished ones are retired
+        self.aborted_transactions = {} # aborted transactions whose end has not arrived yet -> abort cause
+        self.op_retry_queue = {} # op -> transaction index
+        # results handed out by the API for ops waiting in the retry queue
+        self.pending_results: {tuple: [OpResult]} = {}
+        self.current_result = None
+        self.op_value = None
         self.sites = []
-        self.sites_fail_time: {int:[]} = {}
         self.wait_for_graph: {int: set()} = {}
         self.lock_waiting_queue: {int: [()]} = {}
+        # RO transactions with the same snapshot_time see the same snapshot
+        self.last_change_time = 0
+        self.snapshot_cache = SnapshotCache()
+        self.ro_begun_this_tick = [] # RO transactions begun in the current tick
+        # recovering sites copy up to catch_up_batch replicated vars per tick from up to date replicas (0: disabled)
+        self.catch_up_batch = catch_up_batch
+        if self.recorder is not None:
+            self.recorder.options['catch_up_batch'] = self.catch_up_batch
+        self.catch_up_queue: {int: deque} = {} # site index -> vars still recovering
+        self.recover_time = {}
+        self.recovery_durations = [] # (site index, ticks from recovery until all its vars are readable)
 
         # init sites
         for i in range(1, NUM_SITES+1):
             self.sites.append(Site(i))
+        if self.profiler is not None:
+            for site in self.sites:
+                self.profiler.instrument(site.DM, PROFILED_DM_CALLS, "DM.")
+        if self.network is not None:
+            for site in self.sites:
+                self.network.connect(site.DM, site.index)
         logging.info("TM initialized.")
 
         #  init lock waiting queue
@@ -41,34 +86,90 @@ class TransactionManager(object):
 
     def _tick(self):
         self.global_time += 1
+        self.ro_begun_this_tick.clear()
+
+    def _record_change(self):
+        """ committed state or site status changed at this tick """
+        self.last_change_time = self.global_time
+        # RO transactions begun earlier in this tick see the change (versions up to their start_time), move them to the new snapshot
+        for transaction_index in self.ro_begun_this_tick:
+            T = self.transactions.get(transaction_index)
+            if T is not None and T.snapshot_time != self.global_time:
+                self.snapshot_cache.release(T.snapshot_time)
+                T.snapshot_time = self.global_time
+                self.snapshot_cache.acquire(T.snapshot_time)
+
+    def _phase(self, name):
+        """ time a phase if profiling is enabled """
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.phase(name)
+
+    def _trace(self, event_type, code=0, transaction_index=0, var_index=0, site_index=0, value=0):
+        """ record a decision if tracing is enabled """
+        if self.recorder is not None:
+            self.recorder.record(self.global_time, event_type, code, transaction_index, var_index, site_index, value)
+
+    def _end_op(self):
+        """ close the message rounds of an op if the network is simulated """
+        if self.network is not None:
+            self.network.end_op()
 
 
     def execute(self, op=None):
+        """ run one tick with an op string from the input, or only retry waiting ops if op is None """
+        if op:
+            parsed_op = self._parse_op(op)
+            if parsed_op is None:
+                # blank or unknown lines must not end the input, run the tick without an op
+                logging.info("Ignored input line %r at tick: %s." % (op.strip(), self.global_time))
+                self._execute_op(None)
+                return True
+            op = parsed_op
+        return self._execute_op(op)
+
+    def _execute_op(self, op, result=None):
+        """ run one tick with a parsed op """
         success = True
-        
+        # the result is marked aborted if the transaction aborts before its op runs in this tick
+        self.current_result = result
+
         # deadlock detection
-        self._resolve_deadlock()
+        with self._phase("deadlock"):
+            self._resolve_deadlock()
+            self._end_op()
 
         # retry
-        for retry_op in list(self.op_retry_queue.keys()):
-            retry_success, transaction_index = self._translate_op(retry_op)
-            if retry_success:
-                self.op_retry_queue.pop(retry_op)
+        with self._phase("pre_retry"):
+            self._retry_ops()
 
 
         # call translate to execute op if provided
         if op:
-            success, op_transaction_index = self._translate_op(op)
+            with self._phase("translate"):
+                self.op_value = None
+                success, op_transaction_index = self._apply_op(op)
+                self._end_op()
+            if result is not None and result.status == OpResult.OStatus.Done:
+                result.value = self.op_value
+
+        self.current_result = None
 
         # retry
-        for retry_op in list(self.op_retry_queue.keys()):
-            retry_success, transaction_index = self._translate_op(retry_op)
-            if retry_success:
-                self.op_retry_queue.pop(retry_op)
+        with self._phase("post_retry"):
+            self._retry_ops()
+
+        # copy committed values to recovering replicas
+        if len(self.catch_up_queue) != 0:
+            with self._phase("catch_up"):
+                self._catch_up()
 
         # enqueue this op for retrying later if fail
-        if not success and self.transactions[op_transaction_index].status != Transaction.TStatus.Aborted:
+        if not success and op_transaction_index in self.transactions:
             self.op_retry_queue[op] = op_transaction_index
+            if result is not None:
+                result.status = OpResult.OStatus.Blocked
+                self.pending_results.setdefault(op, []).append(result)
 
         self._tick()
 
@@ -76,6 +177,95 @@ class TransactionManager(object):
             return False
         return True
 
+    def _retry_ops(self):
+        """ retry the ops waiting in the retry queue """
+        for retry_op in list(self.op_retry_queue.keys()):
+            # an abort or an end may have taken it out of the queue during this pass
+            if retry_op in self.op_retry_queue:
+                self._retry_op(retry_op)
+
+    def _retry_op(self, retry_op):
+        """ retry one op of the retry queue, return whether it succeeded """
+        self.op_value = None
+        retry_success, transaction_index = self._apply_op(retry_op)
+        self._end_op()
+        if retry_success:
+            # an end that aborted its transaction is already out of the queue
+            self.op_retry_queue.pop(retry_op, None)
+            for result in self.pending_results.pop(retry_op, []):
+                if result.status == OpResult.OStatus.Blocked:
+                    result.status = OpResult.OStatus.Done
+                    result.value = self.op_value
+        return retry_success
+
+    def _print(self, message):
+        """ print a message if echo is enabled """
+        if self.echo:
+            print(message)
+
+    def _report_read(self, transaction_index, var_index, value, version_tick=None):
+        """ hand the value read to the caller, version_tick is None for a transaction's own write """
+        self.op_value = value
+        if self.history is not None and version_tick is not None:
+            self.history.read(transaction_index, var_index, version_tick)
+        if self.echo:
+            IO.print_var(var_index, value)
+
+
+    # in-process API: every call runs one tick like a line of the input and returns an OpResult
+
+    def begin(self, transaction_index):
+        return self.submit(('begin', transaction_index))
+
+    def begin_ro(self, transaction_index):
+        return self.submit(('beginRO', transaction_index))
+
+    def read(self, transaction_index, var_index):
+        return self.submit(('R', transaction_index, var_index))
+
+    def write(self, transaction_index, var_index, value):
+        return self.submit(('W', transaction_index, var_index, value))
+
+    def end(self, transaction_index):
+        return self.submit(('end', transaction_index))
+
+    def fail(self, site_index):
+        return self.submit(('fail', site_index))
+
+    def recover(self, site_index):
+        return self.submit(('recover', site_index))
+
+    def dump(self):
+        return self.submit(('dump',))
+
+    def submit(self, op):
+        """ run one parsed op, e.g. ('W', 1, 2, 100) for W(T1, x2, 100) """
+        result = OpResult(op)
+        if op[0] in ('R', 'W', 'end') and op[1] not in self.transactions:
+            if op[0] == 'end' and op[1] in self.aborted_transactions:
+                result.status = OpResult.OStatus.Aborted
+                result.abort_cause = self.aborted_transactions[op[1]]
+            else:
+                result.status = OpResult.OStatus.Ignored
+        self._execute_op(op, result)
+        return result
+
+    def submit_batch(self, ops):
+        """ run parsed ops one tick each, return their results """
+        results = []
+        for op in ops:
+            results.append(self.submit(op))
+        return results
+
+    def drain(self, max_ticks=None):
+        """ keep ticking until no op waits in the retry queue (or max_ticks ticks passed), return whether it emptied """
+        num_ticks = 0
+        while max_ticks is None or num_ticks < max_ticks:
+            num_ticks += 1
+            if not self._execute_op(None):
+                return True
+        return len(self.op_retry_queue) == 0
+
     def _get_relevent_sites(self, var_index):
         if var_index % 2 == 0:
             return self.sites
@@ -84,6 +274,24 @@ class TransactionManager(object):
 
 
 
+    def _get_read_sites(self, transaction_index, var_index):
+        """ return the relevent sites of a variable in the order _read should try them """
+        relevent_sites = self._get_relevent_sites(var_index)
+        if len(relevent_sites) == 1 or self.read_policy == self.ReadPolicy.First:
+            return relevent_sites
+        if self.read_policy == self.ReadPolicy.RoundRobin:
+            start = self.round_robin_next % len(relevent_sites)
+            self.round_robin_next += 1
+            return relevent_sites[start:] + relevent_sites[:start]
+        if self.read_policy == self.ReadPolicy.LeastLocked:
+            return sorted(relevent_sites, key=lambda site: site.DM.get_lock_occupancy())
+        # sticky: sites the transaction already accessed first, otherwise spread transactions over sites
+        T = self.transactions[transaction_index]
+        start = transaction_index % len(relevent_sites)
+        rotated = relevent_sites[start:] + relevent_sites[:start]
+        return sorted(rotated, key=lambda site: site.index not in T.first_access_time)
+
+
     def _resolve_deadlock(self):
         """ if there exist deadlock, resolve it """
         cycle_exist, cycle = self._detect_cycle()
@@ -103,7 +311,7 @@ class TransactionManager(object):
             cycle_exist = False
             if G.get(u) is not None:
                 for v in G.get(u):
-                    if color[v] == 0:
+                    if color.get(v, 0) == 0:
                         cycle_exist, cycle_start = dfs(G, v, color)
                     elif color[v] == -1:
                         cycle_exist = True
@@ -118,9 +326,9 @@ class TransactionManager(object):
             return cycle_exist, cycle_start
 
 
-        color = [0] * (len(self.transactions)+1)
+        color = {}
         for u in self.wait_for_graph.keys():
-            if color[u] == 0:
+            if color.get(u, 0) == 0:
                 cycle_exist, cycle_start = dfs(self.wait_for_graph, u, color)
                 if cycle_exist:
                     break
@@ -135,44 +343,64 @@ class TransactionManager(object):
                 youngest_index = transaction_index
         
         logging.info("Aborting T%s to break the deadlock." % youngest_index)
-        print("Aborting T%s to break the deadlock." % youngest_index)
-        self._abort_transaction(youngest_index)
+        self._print("Aborting T%s to break the deadlock." % youngest_index)
+        self._abort_transaction(youngest_index, Transaction.AbortCause.Deadlock)
 
     
-    def _translate_op(self, op):
-        """ translate an operation """
+    def _parse_op(self, op):
+        """ parse an operation of the input into a tuple, None if unknown """
         if "begin" in op and "beginRO" not in op:
             transaction_index = int(op[op.find("(")+2 : op.find(")")])
-            return self._begin(transaction_index), transaction_index
+            return ('begin', transaction_index)
         elif "beginRO" in op:
             transaction_index = int(op[op.find("(")+2 : op.find(")")])
-            return self._beginRO(transaction_index), transaction_index
+            return ('beginRO', transaction_index)
         elif "R" in op:
             op = op.replace(" ", "")
             op = op[op.find("(")+1 : op.find(")")]
             transaction_index = int(op.split(",")[0][1:])
             var_index = int(op.split(",")[1][1:])
-            return self._read(transaction_index, var_index), transaction_index
+            return ('R', transaction_index, var_index)
         elif "W" in op:
             op = op.replace(" ", "")
             op = op[op.find("(")+1 : op.find(")")]
             transaction_index = int(op.split(",")[0][1:])
             var_index = int(op.split(",")[1][1:])
             value = int(op.split(",")[2])
-            return self._write(transaction_index, var_index, value), transaction_index
+            return ('W', transaction_index, var_index, value)
         elif "end" in op:
             transaction_index = int(op[op.find("(")+2 : op.find(")")])
-            return self._end(transaction_index), transaction_index
+            return ('end', transaction_index)
         elif "fail" in op:
             site_index = int(op[op.find("(")+1 : op.find(")")])
-            return self._fail(site_index), None
+            return ('fail', site_index)
         elif "recover" in op:
             site_index = int(op[op.find("(")+1 : op.find(")")])
-            return self._recover(site_index), None
+            return ('recover', site_index)
         elif "dump" in op:
-            return self._dump(), None
+            return ('dump',)
         else:
-            return True
+            return None
+
+    def _apply_op(self, op):
+        """ apply a parsed operation, return whether it succeeded and its transaction """
+        kind = op[0]
+        if kind == 'begin':
+            return self._begin(op[1]), op[1]
+        elif kind == 'beginRO':
+            return self._beginRO(op[1]), op[1]
+        elif kind == 'R':
+            return self._read(op[1], op[2]), op[1]
+        elif kind == 'W':
+            return self._write(op[1], op[2], op[3]), op[1]
+        elif kind == 'end':
+            return self._end(op[1]), op[1]
+        elif kind == 'fail':
+            return self._fail(op[1]), None
+        elif kind == 'recover':
+            return self._recover(op[1]), None
+        else:
+            return self._dump(), None
 
     def _begin(self, transaction_index):
         """ start a not read-only transaction """
@@ -183,6 +411,9 @@ class TransactionManager(object):
     def _beginRO(self, transaction_index):
         """ start a read-only transaction """
         T = Transaction(transaction_index, True, self.global_time)
+        T.snapshot_time = self.last_change_time
+        self.snapshot_cache.acquire(T.snapshot_time)
+        self.ro_begun_this_tick.append(transaction_index)
         self.transactions[transaction_index] = T
         return True
 
@@ -191,83 +422,66 @@ class TransactionManager(object):
         """ end a transaction """
         T = self.transactions.get(transaction_index)
         # if already aborted?
-        if T.status == Transaction.TStatus.Aborted:
-            logging.info("Transaction T%s is already aborted." % transaction_index)
+        if T is None:
+            if transaction_index in self.aborted_transactions:
+                # nothing can reference this transaction any more
+                self.aborted_transactions.pop(transaction_index)
+                logging.info("Transaction T%s is already aborted." % transaction_index)
+            else:
+                logging.info("Transaction T%s is not active." % transaction_index)
             return True
 
+        # ops of this transaction still in the retry queue go first, the end waits for the ones waiting for a lock
+        pending_ops = [retry_op for retry_op, retry_transaction_index in self.op_retry_queue.items() if retry_transaction_index == transaction_index and retry_op[0] != 'end']
+        for retry_op in pending_ops:
+            if not self._retry_op(retry_op) and self._waits_for_lock(transaction_index, retry_op):
+                logging.info("T%s waits for its blocked ops before ending." % transaction_index)
+                return False
+
         if T.read_only:
-            if T.status == Transaction.TStatus.Aborted:
-                logging.info("T%s already aborted." % transaction_index)
-                return True
             return self._commit_transaction(transaction_index)
         else:
             # determine whether can commit
             # ensure that all servers you accessed have been up 
             # since the first time they were accessed
-            for site in self.sites:
-                if site.first_access_time.get(transaction_index) is None:
-                    continue
-                last_fail_time = -1
-                if self.sites_fail_time.get(site.index) is not None:
-                    last_fail_index = len(self.sites_fail_time.get(site.index)) - 1
-                    last_fail_time = self.sites_fail_time.get(site.index)[last_fail_index]
-                if site.first_access_time[transaction_index] < last_fail_time:
+            for site_index, first_access_time in T.first_access_time.items():
+                if not self.sites[site_index - 1].uptime.up_between(first_access_time, self.global_time):
                     logging.info("Aborting T%s because some servers it accessed failed after its first access." % transaction_index)
-                    print("Aborting T%s because some servers it accessed failed after its first access." % transaction_index)
-                    return self._abort_transaction(transaction_index)
+                    self._print("Aborting T%s because some servers it accessed failed after its first access." % transaction_index)
+                    return self._abort_transaction(transaction_index, Transaction.AbortCause.SiteFailure, ending=True)
             return self._commit_transaction(transaction_index)
 
 
 
+    def _waits_for_lock(self, transaction_index, op):
+        """ whether a blocked read or write waits for a lock rather than for a site """
+        if transaction_index in self.wait_for_graph:
+            return True
+        return any(wait[0] == transaction_index for wait in self.lock_waiting_queue[op[2]])
+
     def _commit_transaction(self, transaction_index):
         """ commit a transaction """
+        with self._phase("commit"):
+            return self._do_commit_transaction(transaction_index)
+
+    def _do_commit_transaction(self, transaction_index):
         T = self.transactions.get(transaction_index)
-        # release all locks
-        for site in self.sites:
+        # release all locks on the sites this transaction accessed
+        for site_index in sorted(T.first_access_time.keys()):
+            site = self.sites[site_index - 1]
             if site.status != Site.SStatus.Down:
                 site.DM.release_all_locks(transaction_index)
                 # write uncommitted var values to sites
-                site.DM.commit_vars(transaction_index, self.global_time)
+                committed = site.DM.commit_vars(transaction_index, self.global_time)
+                for var_index, value in committed:
+                    self._trace(TraceRecorder.EventType.CommitVersion, 0, transaction_index, var_index, site.index, value)
+                if len(committed) != 0:
+                    self._record_change()
+        T.first_access_time.clear()
+        if T.read_only:
+            self.snapshot_cache.release(T.snapshot_time)
         # check whether lock request in waiting queue can advance
-        for var_index in self.lock_waiting_queue.keys():
-            waiting_queue = self.lock_waiting_queue.get(var_index)
-            if len(waiting_queue) == 0:
-                continue
-            head_transaction = waiting_queue[0][0]
-            head_lock_type = waiting_queue[0][1]
-            
-            if head_lock_type == Lock.LockType.ReadLock:
-                current_locked = True
-                for site in self._get_relevent_sites(var_index):
-                    if site.status != Site.SStatus.Down and site.DM.get_lock_on_var(var_index) is None:
-                        current_locked = False
-                        break
-                if not current_locked:
-                    while head_lock_type == Lock.LockType.ReadLock:
-                        for site in self._get_relevent_sites(var_index):
-                            success, blocking_transactions = site.DM.acquire_read_lock(var_index, head_transaction)
-                            if success:
-                                logging.info("Let the first in lock waiting queue (T%s) get read lock on x%s." % (head_lock_type, var_index))
-                                self.lock_waiting_queue[var_index].remove((head_transaction, head_lock_type))
-                                if len(self.lock_waiting_queue[var_index]) != 0:
-                                    head_transaction = self.lock_waiting_queue[var_index][0][0]
-                                    head_lock_type = self.lock_waiting_queue[var_index][0][1]
-                                break
-                        if len(self.lock_waiting_queue[var_index]) == 0:
-                            break
-                        
-            else:
-                current_locked = False
-                for site in self._get_relevent_sites(var_index):
-                    if site.status != Site.SStatus.Down and site.DM.get_lock_on_var(var_index) is not None:
-                        if not (site.DM.get_lock_on_var(var_index).lock_type == Lock.LockType.ReadLock and len(site.DM.get_lock_on_var(var_index).transactions) == 1 and site.DM.get_lock_on_var(var_index).transactions[0] == head_transaction):
-                            current_locked = True
-                            break
-                if not current_locked:
-                    for site in self._get_relevent_sites(var_index):
-                        site.DM.acquire_write_lock(var_index, head_transaction)
-                    self.lock_waiting_queue[var_index].remove((head_transaction, head_lock_type))
-
+        self._advance_lock_waiting_queues()
 
         # update the wait for graph
         for t in list(self.wait_for_graph.keys()):
@@ -276,30 +490,96 @@ class TransactionManager(object):
                 self.wait_for_graph.get(t).remove(transaction_index)
                 if len(self.wait_for_graph.get(t)) == 0:
                     self.wait_for_graph.pop(t)
+        # reads still waiting for a site are dropped with the transaction
+        for retry_op in list(self.op_retry_queue.keys()):
+            if self.op_retry_queue[retry_op] == transaction_index and retry_op[0] != 'end':
+                self.op_retry_queue.pop(retry_op)
+                logging.info("Dropped %s of T%s, which waits for a site." % (retry_op[0], transaction_index))
+                for result in self.pending_results.pop(retry_op, []):
+                    result.status = OpResult.OStatus.Ignored
         # set status
         T.status = Transaction.TStatus.Committed
+        if self.network is not None:
+            self.network.finish(transaction_index, True)
+        if self.history is not None:
+            self.history.commit(transaction_index, self.global_time)
+        self._trace(TraceRecorder.EventType.Commit, 0, transaction_index)
+        self.transactions.pop(transaction_index)
         logging.info("T%s commits at tick: %s." % (transaction_index, self.global_time))
-        print("T%s commits." % transaction_index)
+        self._print("T%s commits." % transaction_index)
         return True
 
 
-    def _abort_transaction(self, transaction_index):
-        """ abort a transaction """
+    def _abort_transaction(self, transaction_index, cause=None, ending=False):
+        """ abort a transaction, ending if it aborts in its own end """
+        with self._phase("abort"):
+            return self._do_abort_transaction(transaction_index, cause, ending)
+
+    def _do_abort_transaction(self, transaction_index, cause, ending):
         T = self.transactions.get(transaction_index)
-        # release all locks
-        for site in self.sites:
+        # release all locks on the sites this transaction accessed
+        for site_index in sorted(T.first_access_time.keys()):
+            site = self.sites[site_index - 1]
             if site.status != Site.SStatus.Down:
                 site.DM.release_all_locks(transaction_index)
                 site.DM.abort_vars(transaction_index)
+        T.first_access_time.clear()
+        if T.read_only:
+            self.snapshot_cache.release(T.snapshot_time)
 
+        # its lock requests should not be granted any more
+        for var_index in self.lock_waiting_queue.keys():
+            waiting_queue = self.lock_waiting_queue[var_index]
+            if len(waiting_queue) != 0:
+                self.lock_waiting_queue[var_index] = [wait for wait in waiting_queue if wait[0] != transaction_index]
         # check whether lock request in waiting queue can advance
+        self._advance_lock_waiting_queues()
+
+        # update the wait for graph
+        for t in list(self.wait_for_graph.keys()):
+            if t == transaction_index:
+                self.wait_for_graph.pop(t)
+            elif transaction_index in self.wait_for_graph.get(t):
+                self.wait_for_graph.get(t).remove(transaction_index)
+                if len(self.wait_for_graph.get(t)) == 0:
+                    self.wait_for_graph.pop(t)
+        # when aborting a transaction, all associated op in retry queue should be removed
+        for retry_op in list(self.op_retry_queue.keys()):
+            if self.op_retry_queue[retry_op] == transaction_index:
+                self.op_retry_queue.pop(retry_op)
+                # the end is answered here, no later end can ask for the cause
+                if retry_op[0] == 'end':
+                    ending = True
+                for result in self.pending_results.pop(retry_op, []):
+                    result.status = OpResult.OStatus.Aborted
+                    result.abort_cause = cause
+        if self.current_result is not None and self.current_result.op[0] in ('R', 'W', 'end') and self.current_result.op[1] == transaction_index:
+            self.current_result.status = OpResult.OStatus.Aborted
+            self.current_result.abort_cause = cause
+        # set status
+        T.status = Transaction.TStatus.Aborted
+        if self.network is not None:
+            self.network.finish(transaction_index, False)
+        if self.history is not None:
+            self.history.abort(transaction_index)
+        self._trace(TraceRecorder.EventType.Abort, 0 if cause is None else cause.value, transaction_index)
+        self.transactions.pop(transaction_index)
+        if not ending:
+            self.aborted_transactions[transaction_index] = cause
+        logging.info("T%s aborts at tick: %s." % (transaction_index, self.global_time))
+        self._print("T%s aborts." % transaction_index)
+        return True
+
+
+    def _advance_lock_waiting_queues(self):
+        """ grant locks to the heads of the lock waiting queues once they are released """
         for var_index in self.lock_waiting_queue.keys():
             waiting_queue = self.lock_waiting_queue.get(var_index)
             if len(waiting_queue) == 0:
                 continue
             head_transaction = waiting_queue[0][0]
             head_lock_type = waiting_queue[0][1]
-            
+
             if head_lock_type == Lock.LockType.ReadLock:
                 current_locked = True
                 for site in self._get_relevent_sites(var_index):
@@ -309,8 +589,13 @@ class TransactionManager(object):
                 if not current_locked:
                     while head_lock_type == Lock.LockType.ReadLock:
                         for site in self._get_relevent_sites(var_index):
+                            if site.status == Site.SStatus.Down:
+                                continue
                             success, blocking_transactions = site.DM.acquire_read_lock(var_index, head_transaction)
                             if success:
+                                self._trace(TraceRecorder.EventType.LockGrant, Lock.LockType.ReadLock.value, head_transaction, var_index, site.index)
+                                logging.info("Let the first in lock waiting queue (T%s) get read lock on x%s." % (head_transaction, var_index))
+                                self._record_access(head_transaction, site)
                                 self.lock_waiting_queue[var_index].remove((head_transaction, head_lock_type))
                                 if len(self.lock_waiting_queue[var_index]) != 0:
                                     head_transaction = self.lock_waiting_queue[var_index][0][0]
@@ -328,27 +613,18 @@ class TransactionManager(object):
                             break
                 if not current_locked:
                     for site in self._get_relevent_sites(var_index):
+                        if site.status == Site.SStatus.Down:
+                            continue
                         site.DM.acquire_write_lock(var_index, head_transaction)
+                        self._trace(TraceRecorder.EventType.LockGrant, Lock.LockType.WriteLock.value, head_transaction, var_index, site.index)
+                        self._record_access(head_transaction, site)
                     self.lock_waiting_queue[var_index].remove((head_transaction, head_lock_type))
 
-
-        # update the wait for graph
-        for t in list(self.wait_for_graph.keys()):
-            if t == transaction_index:
-                self.wait_for_graph.pop(t)
-            elif transaction_index in self.wait_for_graph.get(t):
-                self.wait_for_graph.get(t).remove(transaction_index)
-                if len(self.wait_for_graph.get(t)) == 0:
-                    self.wait_for_graph.pop(t)
-        # when aborting a transaction, all associated op in retry queue should be removed
-        for retry_op in list(self.op_retry_queue.keys()):
-            if self.op_retry_queue[retry_op] == transaction_index:
-                self.op_retry_queue.pop(retry_op)
-        # set status
-        T.status = Transaction.TStatus.Aborted
-        logging.info("T%s aborts at tick: %s." % (transaction_index, self.global_time))
-        print("T%s aborts." % transaction_index)
-        return True
+    def _record_access(self, transaction_index, site):
+        """ remember that a transaction accessed a site """
+        T = self.transactions.get(transaction_index)
+        if T is not None:
+            T.record_access(site.index, self.global_time)
 
 
     def _read(self, transaction_index, var_index):
@@ -367,7 +643,7 @@ class TransactionManager(object):
                 acquired_lock = False
                 for site in self._get_relevent_sites(var_index):
                     lock_on_var = site.DM.get_lock_on_var(var_index)
-                    if lock_on_var is not None and ((lock_on_var.LockType == Lock.LockType.ReadLock and transaction_index in lock_on_var.transactions) or (lock_on_var.lock_type == Lock.LockType.WriteLock and transaction_index in lock_on_var.transactions)):
+                    if lock_on_var is not None and ((lock_on_var.lock_type == Lock.LockType.ReadLock and transaction_index in lock_on_var.transactions) or (lock_on_var.lock_type == Lock.LockType.WriteLock and transaction_index in lock_on_var.transactions)):
                         acquired_lock = True
                         break
                 if not acquired_lock:
@@ -392,6 +668,7 @@ class TransactionManager(object):
 
                     # update lock waiting queue
                     self.lock_waiting_queue[var_index].append((transaction_index, Lock.LockType.ReadLock))
+                    self._trace(TraceRecorder.EventType.QueueInsert, Lock.LockType.ReadLock.value, transaction_index, var_index)
                     logging.info("Other ops waiting for lock on x%s. T%s has to wait for read lock in the queue." % (var_index, transaction_index))
                     return False
 
@@ -400,11 +677,11 @@ class TransactionManager(object):
             # first check uncommitted var
             uncommitted = self.transactions[transaction_index].uncommitted_vars.get(var_index)
             if uncommitted is not None:
-                IO.print_var(var_index, uncommitted)
+                self._report_read(transaction_index, var_index, uncommitted)
                 logging.info("Read x%s = %s from uncommitted variables in T%s." % (var_index, uncommitted, transaction_index))
                 return True
 
-            relevent_sites = self._get_relevent_sites(var_index)
+            relevent_sites = self._get_read_sites(transaction_index, var_index)
             num_sites_unavailable = 0
             for site in relevent_sites:
                 if site.status == Site.SStatus.Down:
@@ -419,13 +696,16 @@ class TransactionManager(object):
                     self.transactions[transaction_index].status = Transaction.TStatus.Blocked
                     # update lock waiting queue
                     self.lock_waiting_queue[var_index].append((transaction_index, Lock.LockType.ReadLock))
+                    self._trace(TraceRecorder.EventType.QueueInsert, Lock.LockType.ReadLock.value, transaction_index, var_index)
                     return False
                 elif not success and len(blocking_transactions) == 0: # variable not ready
                     num_sites_unavailable += 1
                 elif success:
+                    version = site.DM.get_versions(var_index)[-1]
+                    self._report_read(transaction_index, var_index, version[1], version[0])
+                    self._trace(TraceRecorder.EventType.LockGrant, Lock.LockType.ReadLock.value, transaction_index, var_index, site.index)
                     # record first access time
-                    if site.first_access_time.get(transaction_index) is None:
-                        site.first_access_time[transaction_index] = self.global_time
+                    T.record_access(site.index, self.global_time)
                     break
             if num_sites_unavailable == len(relevent_sites): # no sites available for read
                 return False
@@ -482,6 +762,7 @@ class TransactionManager(object):
 
                 # update lock waiting queue
                 self.lock_waiting_queue[var_index].append((transaction_index, Lock.LockType.WriteLock))
+                self._trace(TraceRecorder.EventType.QueueInsert, Lock.LockType.WriteLock.value, transaction_index, var_index)
                 logging.info("Other ops waiting for lock on x%s. T%s has to wait for write lock in the queue." % (var_index, transaction_index))
                 return False
 
@@ -507,6 +788,7 @@ class TransactionManager(object):
             self.transactions[transaction_index].status = Transaction.TStatus.Blocked
             # update lock waiting queue
             self.lock_waiting_queue[var_index].append((transaction_index, Lock.LockType.WriteLock))
+            self._trace(TraceRecorder.EventType.QueueInsert, Lock.LockType.WriteLock.value, transaction_index, var_index)
             return False
                 
         if num_sites_unavailable == len(relevent_sites):
@@ -517,13 +799,16 @@ class TransactionManager(object):
             if site.status == Site.SStatus.Down:
                 continue
             success, blocking_transactions = site.DM.write(var_index, value, transaction_index)
+            if success:
+                self._trace(TraceRecorder.EventType.LockGrant, Lock.LockType.WriteLock.value, transaction_index, var_index, site.index)
             # record first access time
-            if site.first_access_time.get(transaction_index) is None:
-                site.first_access_time[transaction_index] = self.global_time
+            T.record_access(site.index, self.global_time)
             
         
         # if can write, save value in uncommitted vars
         self.transactions[transaction_index].write_uncommitted(var_index, value)
+        if self.history is not None:
+            self.history.write(transaction_index, var_index)
 
         return True
 
@@ -531,61 +816,118 @@ class TransactionManager(object):
     def _fail(self, site_index):
         """ make a site fail """
         self.sites[site_index - 1].fail(self.global_time)
-        if self.sites_fail_time.get(site_index) is None:
-            self.sites_fail_time[site_index] = []
-        self.sites_fail_time[site_index].append(self.global_time)
+        self._record_change()
+        self.catch_up_queue.pop(site_index, None)
         return True
 
     def _recover(self, site_index):
         """ make a site recover """
-        self.sites[site_index - 1].recover()
+        site = self.sites[site_index - 1]
+        site.recover(self.global_time)
+        self._record_change()
+        if self.catch_up_batch > 0:
+            self.catch_up_queue[site_index] = deque(var_index for var_index in site.DM.get_managed_vars() if var_index % 2 == 0)
+            self.recover_time[site_index] = self.global_time
         return True
 
-    def _dump(self):
-        """ dump committed values of all copies of all variables at all sites """
+    def _catch_up(self):
+        """ copy the latest committed version of recovering vars from replicas that stayed up, in bounded batches """
+        for site_index in list(self.catch_up_queue.keys()):
+            site = self.sites[site_index - 1]
+            queue = self.catch_up_queue[site_index]
+            num_copied = 0
+            num_unavailable = 0
+            while len(queue) != 0 and num_copied < self.catch_up_batch and num_unavailable < len(queue):
+                var_index = queue.popleft()
+                # already written since the recovery
+                if site.DM.get_var_status(var_index) != DataManager.VStatus.Recovering:
+                    continue
+                version = self._get_up_to_date_version(var_index, site_index)
+                if version is None:
+                    # no replica to copy from yet, try again later
+                    queue.append(var_index)
+                    num_unavailable += 1
+                    continue
+                site.DM.catch_up_var(var_index, version, self.global_time)
+                num_copied += 1
+            if len(queue) == 0:
+                self.catch_up_queue.pop(site_index)
+                site.status = Site.SStatus.Up
+                duration = self.global_time - self.recover_time.pop(site_index)
+                self.recovery_durations.append((site_index, duration))
+                logging.info("Site %s is fully available %s ticks after recovering." % (site_index, duration))
+
+    def _get_up_to_date_version(self, var_index, excluded_site_index):
+        """ latest committed version of a var on a replica that is up and ready, None if there is none """
+        for site in self._get_relevent_sites(var_index):
+            if site.index == excluded_site_index or site.status == Site.SStatus.Down:
+                continue
+            if site.DM.get_var_status(var_index) == DataManager.VStatus.Ready:
+                return site.DM.get_versions(var_index)[-1]
+        return None
+
+    def _dump(self, tick=None):
+        """ dump committed values of all copies of all variables at all sites (as of tick if given) """
+        if self.dump_format is not None:
+            site_states = []
+            for site in self.sites:
+                site_states.append((site.index, site.DM.get_managed_vars(), site.DM.dump_values(tick)))
+            filename = "%s_%s.%s" % (self.dump_prefix, self.global_time, self.dump_format)
+            IO.export_dump(filename, self.dump_format, site_states, NUM_VARS)
+            return True
         snapshot = {}
         for site_index, site in enumerate(self.sites):
-            site_snapshot = site.DM.dump()
+            site_snapshot = site.DM.dump(tick)
             snapshot[site_index+1] = site_snapshot
-        IO.dump(snapshot)
+        self.op_value = snapshot
+        if self.echo:
+            IO.dump(snapshot)
         return True
 
 
+    def _get_snapshot_sites(self, relevent_sites, start_time):
+        """ replicas that can hold a valid snapshot at start_time, the ones that never failed by then first """
+        # a replica that was down at start_time missed the snapshot,
+        # one that never failed by then has every version up to start_time
+        candidates = [site for site in relevent_sites if site.status != Site.SStatus.Down and not site.uptime.is_down_at(start_time)]
+        return sorted(candidates, key=lambda site: site.uptime.failed_by(start_time))
+
     def _read_from_snapshot(self, transaction_index, var_index, start_time):
         """ read for RO transactions """
         success = False
         retry = False
 
+        # served from the shared snapshot if another RO transaction already resolved this var
+        snapshot_time = self.transactions[transaction_index].snapshot_time
+        cached = self.snapshot_cache.get(snapshot_time, var_index)
+        if cached is not None and self.sites[cached[1] - 1].status != Site.SStatus.Down:
+            self._report_read(transaction_index, var_index, cached[0], cached[2])
+            logging.info("Read x%s = %s from the snapshot at tick %s by T%s." % (var_index, cached[0], snapshot_time, transaction_index))
+            return True
+
         if var_index % 2 != 0:
             # odd indexed (no duplicates)
             site = self.sites[var_index % 10]
             if site.status != Site.SStatus.Down:
-                success = site.DM.read_from_snapshot(var_index, start_time, None, None, transaction_index)
+                success, version = site.DM.read_from_snapshot(var_index, start_time, transaction_index)
             else:
                 retry = True
         else:
             # even indexed (duplicates)
             relevent_sites = self._get_relevent_sites(var_index)
-            num_sites_down = 0
-            for site in relevent_sites:
-                if site.status == Site.SStatus.Down:
-                    num_sites_down += 1
-                    continue
-                last_fail_time = None
-                first_fail_time = None
-                if self.sites_fail_time.get(site.index) is not None:
-                    last_fail_index = len(self.sites_fail_time.get(site.index)) - 1
-                    last_fail_time = self.sites_fail_time.get(site.index)[last_fail_index]
-                    first_fail_time = self.sites_fail_time.get(site.index)[0]
-                success = site.DM.read_from_snapshot(var_index, start_time, first_fail_time, last_fail_time, transaction_index)
+            for site in self._get_snapshot_sites(relevent_sites, start_time):
+                success, version = site.DM.read_from_snapshot(var_index, start_time, transaction_index)
                 if success:
                     break
-            if num_sites_down == len(relevent_sites):
+            if all(site.status == Site.SStatus.Down for site in relevent_sites):
                 retry = True
+        if success:
+            self._report_read(transaction_index, var_index, version[1], version[0])
+            self.snapshot_cache.put(snapshot_time, var_index, version[1], site.index, version[0])
         if not success and not retry:
             logging.info("Aborting T%s because no relevent site has a committed version before T%s began and has not failed in between." % (transaction_index, transaction_index))
-            print("Aborting T%s because no relevent site has a committed version before T%s began and has not failed in between." % (transaction_index, transaction_index))
-            self._abort_transaction(transaction_index)
+            self._print("Aborting T%s because no relevent site has a committed version before T%s began and has not failed in between." % (transaction_index, transaction_index))
+            self._abort_transaction(transaction_index, Transaction.AbortCause.NoSnapshot)
         return success
 
 
@@ -0,0 +1,40 @@
+import os
+import logging
+from bisect import bisect_left, bisect_right
+
+
+class UptimeIndex(object):
+    """ up/down intervals of a site, kept as sorted failure and recovery ticks """
+
+    def __init__(self):
+        self.fail_times = []
+        self.recover_times = []
+
+    def record_fail(self, tick):
+        """ the site goes down at tick """
+        self.fail_times.append(tick)
+
+    def record_recover(self, tick):
+        """ the site comes back at tick """
+        self.recover_times.append(tick)
+
+    def is_down_at(self, tick):
+        """ whether the site is down at tick """
+        num_fails = bisect_right(self.fail_times, tick)
+        if num_fails == 0:
+            return False
+        last_fail_time = self.fail_times[num_fails - 1]
+        # down unless a recovery happened between the last failure and tick
+        next_recover = bisect_right(self.recover_times, last_fail_time)
+        return next_recover == len(self.recover_times) or self.recover_times[next_recover] > tick
+
+    def up_between(self, start_tick, end_tick):
+        """ whether the site stayed up continuously from start_tick to end_tick (both inclusive) """
+        next_fail = bisect_left(self.fail_times, start_tick)
+        if next_fail < len(self.fail_times) and self.fail_times[next_fail] <= end_tick:
+            return False
+        return not self.is_down_at(start_tick)
+
+    def failed_by(self, tick):
+        """ whether the site failed at or before tick """
+        return len(self.fail_times) != 0 and self.fail_times[0] <= tick